@@ -2,6 +2,7 @@ import os
 from datetime import datetime
 from enum import Enum
 import numpy as np
+from numba import njit
 from gym import spaces
 import pybullet as p
 import pybullet_data
@@ -32,6 +33,210 @@ class ObservationType(Enum):
 
 ################################################################################
 
+#### Integer tags indexing the dispatch tables of MyAviary #########
+_ACT_TAGS = {act: i for i, act in enumerate(ActionType)}
+_OBS_TAGS = {obs: i for i, obs in enumerate(ObservationType)}
+
+#### Bounds of the action and observation spaces ###################
+_ONES = {n: np.ones(n, np.float32) for n in (1, 3, 4, 6)}
+_NEG_ONES = {n: -np.ones(n, np.float32) for n in (1, 3, 4, 6)}
+#### KIN: target position error, velocity, angular velocity, rotation matrix
+_KIN_LOW = np.array([-1,-1,-1, -1,-1,-1, -1,-1,-1, -1,-1,-1,-1,-1,-1,-1,-1,-1], np.float32)
+_KIN_HIGH = np.array([1,1,1, 1,1,1, 1,1,1, 1,1,1,1,1,1,1,1,1], np.float32)
+
+#### Shared read-only constants ####################################
+_ZERO3 = np.zeros(3)
+_IDENTITY_QUAT = (0., 0., 0., 1.)   # Same as p.getQuaternionFromEuler([0, 0, 0])
+_LANDMARKS = (("block.urdf", (1, 0, .1)),
+              ("cube_small.urdf", (0, 1, .1)),
+              ("duck_vhacd.urdf", (-1, 0, .1)),
+              ("teddy_vhacd.urdf", (0, -1, .1)))
+
+################################################################################
+
+@njit(cache=True, fastmath=True)
+def _rpm_jit(action, hover_rpm, out):
+    """Converts a (4,)-shaped normalized action into motors' RPMs.
+    Parameters
+    ----------
+    action : ndarray
+        (4,)-shaped array of normalized RPMs, one per motor.
+    hover_rpm : float
+        The hovering RPM of the drone.
+    out : ndarray
+        (4,)-shaped buffer the RPMs are written into.
+    Returns
+    -------
+    ndarray
+        The `out` buffer.
+    """
+    for i in range(4):
+        out[i] = hover_rpm * (1. + 0.05*action[i])
+    return out
+
+################################################################################
+
+@njit(cache=True, fastmath=True)
+def _one_d_rpm_jit(action, hover_rpm, out):
+    """Converts a (1,)-shaped normalized action into 4 identical RPMs.
+    Parameters
+    ----------
+    action : ndarray
+        (1,)-shaped array containing the normalized RPM shared by all motors.
+    hover_rpm : float
+        The hovering RPM of the drone.
+    out : ndarray
+        (4,)-shaped buffer the RPMs are written into.
+    Returns
+    -------
+    ndarray
+        The `out` buffer.
+    """
+    rpm = hover_rpm * (1. + 0.05*action[0])
+    for i in range(4):
+        out[i] = rpm
+    return out
+
+################################################################################
+
+@njit(cache=True, fastmath=True)
+def _dyn_mix(inv_a, b_coeff, thrust, x_torque, y_torque, z_torque, out):
+    """Converts the desired thrust and torques into motors' RPMs.
+    Unconstrained solution of `nnlsRPM()`, valid only when none of the
+    squared RPMs is negative.
+    Parameters
+    ----------
+    inv_a : ndarray
+        (4, 4)-shaped inverse of the mixer matrix.
+    b_coeff : ndarray
+        (4,)-shaped array of coefficients mapping thrust and torques to squared RPMs.
+    thrust : float
+        Desired thrust along the drone's z-axis.
+    x_torque : float
+        Desired drone's x-axis torque.
+    y_torque : float
+        Desired drone's y-axis torque.
+    z_torque : float
+        Desired drone's z-axis torque.
+    out : ndarray
+        (4,)-shaped buffer the RPMs are written into.
+    Returns
+    -------
+    bool
+        Whether the solution is feasible, i.e. `out` holds the RPMs.
+    """
+    b0 = thrust * b_coeff[0]
+    b1 = x_torque * b_coeff[1]
+    b2 = y_torque * b_coeff[2]
+    b3 = z_torque * b_coeff[3]
+    for i in range(4):
+        sq_rpm = inv_a[i, 0]*b0 + inv_a[i, 1]*b1 + inv_a[i, 2]*b2 + inv_a[i, 3]*b3
+        if sq_rpm < 0.:
+            return False
+        out[i] = np.sqrt(sq_rpm)
+    return True
+
+################################################################################
+
+@njit(cache=True, fastmath=True)
+def _kin_obs(target_pos, state, out):
+    """Fills the (18,)-shaped kinematic observation.
+    The rotation matrix R = Rz(yaw) @ Ry(pitch) @ Rx(roll) is computed directly
+    from the roll, pitch, and yaw angles and written in row-major order, as
+    returned by PyBullet's `getMatrixFromQuaternion()`.
+    Parameters
+    ----------
+    target_pos : ndarray
+        (3,)-shaped array containing the XYZ position of the target.
+    state : ndarray
+        (20,)-shaped state vector, as returned by `_getDroneStateVector()`.
+    out : ndarray
+        (18,)-shaped buffer the observation is written into.
+    Returns
+    -------
+    ndarray
+        The `out` buffer.
+    """
+    for i in range(3):
+        out[i] = target_pos[i] - state[i]
+        out[3+i] = state[10+i]
+        out[6+i] = state[13+i]
+    sr, cr = np.sin(state[7]), np.cos(state[7])
+    sp, cp = np.sin(state[8]), np.cos(state[8])
+    sy, cy = np.sin(state[9]), np.cos(state[9])
+    out[9] = cy*cp
+    out[10] = cy*sp*sr - sy*cr
+    out[11] = cy*sp*cr + sy*sr
+    out[12] = sy*cp
+    out[13] = sy*sp*sr + cy*cr
+    out[14] = sy*sp*cr - cy*sr
+    out[15] = -sp
+    out[16] = cp*sr
+    out[17] = cp*cr
+    return out
+
+################################################################################
+
+@njit(cache=True, fastmath=True)
+def _reward_kernel(state, target_pos, hover_rpm, prev_action, aggr):
+    """Computes the reward from the state vector.
+    The normalized action ((rpm/hover_rpm) - 1) * 20 is recovered from the
+    last clipped RPMs in `state[16:20]`, and stored in `prev_action`.
+    Parameters
+    ----------
+    state : ndarray
+        (20,)-shaped state vector, as returned by `_getDroneStateVector()`.
+    target_pos : ndarray
+        (3,)-shaped array containing the XYZ position of the target.
+    hover_rpm : float
+        The hovering RPM of the drone.
+    prev_action : ndarray
+        (4,)-shaped normalized action of the previous step, updated in place.
+    aggr : int
+        The number of physics steps within one call to `step()`.
+    Returns
+    -------
+    float
+        The reward.
+    """
+    dx = state[0] - target_pos[0]
+    dy = state[1] - target_pos[1]
+    dz = state[2] - target_pos[2]
+    pos_err = np.sqrt(dx*dx + dy*dy + dz*dz)
+    att_err = np.sqrt(state[7]*state[7] + state[8]*state[8] + state[9]*state[9])
+    vel_err = np.sqrt(state[10]*state[10] + state[11]*state[11] + state[12]*state[12])
+    act_sq = 0.
+    da_sq = 0.
+    for i in range(4):
+        action = ((state[16+i]/hover_rpm) - 1.0) * 20.0
+        act_sq += action*action
+        da = (action - prev_action[i]) / aggr
+        da_sq += da*da
+        prev_action[i] = action
+    act_err = np.sqrt(act_sq)
+    da = np.sqrt(da_sq)
+    return 2.0 - 1.0 * pos_err - 0.04 * vel_err - 0.02 * att_err - 0.02 * act_err - 0.001*da
+
+################################################################################
+
+@njit(cache=True)
+def _done_kernel(state):
+    """Checks whether the drone left the flight volume or flipped over.
+    Parameters
+    ----------
+    state : ndarray
+        (20,)-shaped state vector, as returned by `_getDroneStateVector()`.
+    Returns
+    -------
+    bool
+        Whether the current episode is done.
+    """
+    half_pi = np.pi/2.0
+    return (abs(state[0]) > 3. or abs(state[1]) > 3. or abs(state[2]) > 3. or abs(state[2]) < 0.02
+            or abs(state[7]) > half_pi or abs(state[8]) > half_pi or abs(state[9]) > half_pi)
+
+################################################################################
+
 class MyAviary(BaseAviary):
     """Base single drone environment class for reinforcement learning."""
     
@@ -83,8 +288,24 @@ class MyAviary(BaseAviary):
         self.ACT_TYPE = act
         self.EPISODE_LEN_SEC = 5
         self.target_ID = None
-        self.prev_action = None
+        self.prev_action = np.zeros(4)
         self.prev_pos_err = None
+        self._step_state = np.zeros(20)
+        #### Dispatch tables, in the order of the enumerations ###
+        self._act_tag = _ACT_TAGS[act]
+        self._act_dispatch = [self._preprocessAction_rpm,
+                              self._preprocessAction_dyn,
+                              self._preprocessAction_thr,
+                              self._preprocessAction_pid,
+                              self._preprocessAction_vel,
+                              self._preprocessAction_tun,
+                              self._preprocessAction_one_d_rpm,
+                              self._preprocessAction_one_d_dyn,
+                              self._preprocessAction_one_d_pid]
+        self._obs_tag = _OBS_TAGS[obs]
+        self._obs_dispatch = [self._computeObs_kin,
+                              self._computeObs_rgb]
+        self._obs_buf = np.empty(18, np.float32)
         
         #### Create integrated controllers #########################
         if act in [ActionType.PID, ActionType.VEL, ActionType.TUN, ActionType.THR, ActionType.ONE_D_PID]:
@@ -125,6 +346,14 @@ class MyAviary(BaseAviary):
                          vision_attributes=vision_attributes,
                          dynamics_attributes=dynamics_attributes
                          )
+        #### Duration of one call to step(), used by the controllers
+        self.CTRL_TIMESTEP = self.AGGR_PHY_STEPS*self.TIMESTEP
+        #### Contiguous mixer inverse for _dyn_mix() ###############
+        if dynamics_attributes:
+            self._inv_a_c = np.ascontiguousarray(self.INV_A, np.float64)
+        #### Keep camera captures as uint8, like the observation space
+        if obs == ObservationType.RGB:
+            self.rgb = np.zeros((self.NUM_DRONES, self.IMG_RES[1], self.IMG_RES[0], 4), np.uint8)
         #### Set a limit on the maximum target speed ###############
         if act == ActionType.VEL:
             self.SPEED_LIMIT = 0.03 * self.MAX_SPEED_KMH * (1000/3600)
@@ -133,57 +362,101 @@ class MyAviary(BaseAviary):
                 print("[ERROR] in BaseSingleAgentAviary.__init__(), ActionType.TUN requires an implementation of _trajectoryTrackingRPMs in the instantiated subclass")
                 exit()
                 
-        self.target_position = self.INIT_XYZS[0]
+        self.target_position = np.array(self.INIT_XYZS[0], dtype=np.float32)
+        #### Bind the handlers of the chosen types to the instance #
+        #### ACT_TYPE and OBS_TYPE never change after construction
+        #### Subclasses overriding the methods keep their own ######
+        if type(self)._preprocessAction is MyAviary._preprocessAction:
+            self._preprocessAction = self._act_dispatch[self._act_tag]
+        if type(self)._computeObs is MyAviary._computeObs:
+            self._computeObs = self._obs_dispatch[self._obs_tag]
         
     ################################################################################
 
+    def reset(self):
+        """Resets the environment.
+        Resetting the simulation removes the target's body, it is loaded
+        again by the next visual call to `_addTarget()`.
+        Extends BaseAviary's method.
+        Returns
+        -------
+        ndarray | dict[..]
+            The initial observation, check the specific implementation of `_computeObs()`
+            in each subclass for its format.
+        """
+        self.target_ID = None
+        return super().reset()
+
+    ################################################################################
+
+    def _updateAndStoreKinematicInformation(self):
+        """Updates and stores the drones kinematic information.
+        Also refreshes the state vector of the drone in `_step_state`, read by
+        `_preprocessAction()`, `_computeObs()`, `_computeReward()`, and
+        `_computeDone()` instead of calling `_getDroneStateVector()` each.
+        Extends BaseAviary's method.
+        """
+        super()._updateAndStoreKinematicInformation()
+        self._getStateInto(self._step_state)
+
+    ################################################################################
+
+    def _getStateInto(self, out):
+        """Writes the state vector of the drone into a buffer, in place.
+        Same layout as BaseAviary's `_getDroneStateVector()`, without
+        allocating a new array.
+        Parameters
+        ----------
+        out : ndarray
+            (20,)-shaped buffer the state vector is written into.
+        Returns
+        -------
+        ndarray
+            The `out` buffer.
+        """
+        out[0:3] = self.pos[0, :]
+        out[3:7] = self.quat[0, :]
+        out[7:10] = self.rpy[0, :]
+        out[10:13] = self.vel[0, :]
+        out[13:16] = self.ang_v[0, :]
+        out[16:20] = self.last_clipped_action[0, :]
+        return out
+
+    ################################################################################
+
     def _addObstacles(self):
         """Add obstacles to the environment.
         Only if the observation is of type RGB, 4 landmarks are added.
         Overrides BaseAviary's method.
         """
         if self.OBS_TYPE == ObservationType.RGB:
-            p.loadURDF("block.urdf",
-                       [1, 0, .1],
-                       p.getQuaternionFromEuler([0, 0, 0]),
-                       physicsClientId=self.CLIENT
-                       )
-            p.loadURDF("cube_small.urdf",
-                       [0, 1, .1],
-                       p.getQuaternionFromEuler([0, 0, 0]),
-                       physicsClientId=self.CLIENT
-                       )
-            p.loadURDF("duck_vhacd.urdf",
-                       [-1, 0, .1],
-                       p.getQuaternionFromEuler([0, 0, 0]),
-                       physicsClientId=self.CLIENT
-                       )
-            p.loadURDF("teddy_vhacd.urdf",
-                       [0, -1, .1],
-                       p.getQuaternionFromEuler([0, 0, 0]),
-                       physicsClientId=self.CLIENT
-                       )
+            for urdf, position in _LANDMARKS:
+                p.loadURDF(urdf,
+                           position,
+                           _IDENTITY_QUAT,
+                           physicsClientId=self.CLIENT
+                           )
         else:
             pass
 
     
     
     def _addTarget(self, position, visual=True):
-        self.target_position = np.array(position)
+        self.target_position = np.array(position, dtype=np.float32)
         self.prev_ = None
         if visual:
-            if not self.target_ID:
+            if self.target_ID is None:
             
                 self.target_ID = p.loadURDF("cube_small.urdf",
                                        position,
-                                       p.getQuaternionFromEuler([0, 0, 0]),
+                                       _IDENTITY_QUAT,
                                        physicsClientId=self.CLIENT)
             
             else:
                 
                 p.resetBasePositionAndOrientation(self.target_ID,
                                                   position,
-                                                  p.getQuaternionFromEuler([0, 0, 0]),
+                                                  _IDENTITY_QUAT,
                                                   physicsClientId=self.CLIENT)
                 
     
@@ -209,9 +482,9 @@ class MyAviary(BaseAviary):
         else:
             print("[ERROR] in BaseSingleAgentAviary._actionSpace()")
             exit()
-        return spaces.Box(low=-1*np.ones(size),
+        return spaces.Box(low=_NEG_ONES[size],
         # return spaces.Box(low=np.zeros(size),  # Alternative action space, see PR #32
-                          high=np.ones(size),
+                          high=_ONES[size],
                           dtype=np.float32
                           )
 
@@ -225,6 +498,9 @@ class MyAviary(BaseAviary):
         action types: `action` can be of length 1, 3, 4, or 6 and represent 
         RPMs, desired thrust and torques, the next target position to reach 
         using PID control, a desired velocity vector, new PID coefficients, etc.
+        The handler of each action type is looked up by integer tag in
+        `_act_dispatch`; `__init__()` binds the handler of `act` directly
+        to the instance, bypassing this method, unless a subclass overrides it.
         Parameters
         ----------
         action : ndarray
@@ -234,97 +510,131 @@ class MyAviary(BaseAviary):
         ndarray
             (4,)-shaped array of ints containing to clipped RPMs
             commanded to the 4 motors of each drone.
+            A new array at every call: BaseAviary keeps (a view of) it as
+            `last_clipped_action`, e.g. for the drag of the next step, so it
+            must not be shared with buffers overwritten by later calls.
         """
-        if self.ACT_TYPE == ActionType.TUN:
-            self.ctrl.setPIDCoefficients(p_coeff_pos=(action[0]+1)*self.TUNED_P_POS,
-                                         i_coeff_pos=(action[1]+1)*self.TUNED_I_POS,
-                                         d_coeff_pos=(action[2]+1)*self.TUNED_D_POS,
-                                         p_coeff_att=(action[3]+1)*self.TUNED_P_ATT,
-                                         i_coeff_att=(action[4]+1)*self.TUNED_I_ATT,
-                                         d_coeff_att=(action[5]+1)*self.TUNED_D_ATT
-                                         )
-            return self._trajectoryTrackingRPMs() 
-        elif self.ACT_TYPE == ActionType.RPM:
-            return np.array(self.HOVER_RPM * (1+0.05*action))
-        elif self.ACT_TYPE == ActionType.THR:
-            state = self._getDroneStateVector(0)
-           
-            rpm = self.ctrl._dslPIDAttitudeControl(control_timestep = self.AGGR_PHY_STEPS*self.TIMESTEP,
+        return self._act_dispatch[self._act_tag](action)
+
+    ################################################################################
+
+    def _preprocessAction_rpm(self, action):
+        """Pre-processes an ActionType.RPM action, see `_preprocessAction()`."""
+        return _rpm_jit(action, self.HOVER_RPM, np.empty(4))
+
+    def _preprocessAction_dyn(self, action):
+        """Pre-processes an ActionType.DYN action, see `_preprocessAction()`."""
+        max_xy_torque = self.MAX_XY_TORQUE
+        max_z_torque = self.MAX_Z_TORQUE
+        thrust = self.GRAVITY*(action[0]+1)
+        x_torque = 0.05*max_xy_torque*action[1]
+        y_torque = 0.05*max_xy_torque*action[2]
+        z_torque = 0.05*max_z_torque*action[3]
+        #### Fall back to NNLS when clipping (or GUI warnings) are needed
+        rpm = np.empty(4)
+        if not self.GUI and _dyn_mix(self._inv_a_c, self.B_COEFF, thrust, x_torque, y_torque, z_torque, rpm):
+            return rpm
+        return nnlsRPM(thrust=thrust,
+                       x_torque=x_torque,
+                       y_torque=y_torque,
+                       z_torque=z_torque,
+                       counter=self.step_counter,
+                       max_thrust=self.MAX_THRUST,
+                       max_xy_torque=max_xy_torque,
+                       max_z_torque=max_z_torque,
+                       a=self.A,
+                       inv_a=self.INV_A,
+                       b_coeff=self.B_COEFF,
+                       gui=self.GUI
+                       )
+
+    def _preprocessAction_thr(self, action):
+        """Pre-processes an ActionType.THR action, see `_preprocessAction()`."""
+        state = self._step_state
+        rpm = self.ctrl._dslPIDAttitudeControl(control_timestep = self.CTRL_TIMESTEP,
                                                thrust = self.GRAVITY*(action+1),
                                                cur_quat = state[3:7],
                                                target_euler = state[7:10],
                                                target_rpy_rates = state[13:16])
-            
-         
-            return rpm
-        elif self.ACT_TYPE == ActionType.DYN:
-            return nnlsRPM(thrust=(self.GRAVITY*(action[0]+1)),
-                           x_torque=(0.05*self.MAX_XY_TORQUE*action[1]),
-                           y_torque=(0.05*self.MAX_XY_TORQUE*action[2]),
-                           z_torque=(0.05*self.MAX_Z_TORQUE*action[3]),
-                           counter=self.step_counter,
-                           max_thrust=self.MAX_THRUST,
-                           max_xy_torque=self.MAX_XY_TORQUE,
-                           max_z_torque=self.MAX_Z_TORQUE,
-                           a=self.A,
-                           inv_a=self.INV_A,
-                           b_coeff=self.B_COEFF,
-                           gui=self.GUI
-                           )
-        elif self.ACT_TYPE == ActionType.PID: 
-            state = self._getDroneStateVector(0)
-            rpm, _, _ = self.ctrl.computeControl(control_timestep=self.AGGR_PHY_STEPS*self.TIMESTEP, 
-                                                 cur_pos=state[0:3],
-                                                 cur_quat=state[3:7],
-                                                 cur_vel=state[10:13],
-                                                 cur_ang_vel=state[13:16],
-                                                 target_pos=state[0:3]+0.1*action
-                                                 )
-            return rpm
-        elif self.ACT_TYPE == ActionType.VEL:
-            state = self._getDroneStateVector(0)
-            if np.linalg.norm(action[0:3]) != 0:
-                v_unit_vector = action[0:3] / np.linalg.norm(action[0:3])
-            else:
-                v_unit_vector = np.zeros(3)
-            rpm, _, _ = self.ctrl.computeControl(control_timestep=self.AGGR_PHY_STEPS*self.TIMESTEP, 
-                                                 cur_pos=state[0:3],
-                                                 cur_quat=state[3:7],
-                                                 cur_vel=state[10:13],
-                                                 cur_ang_vel=state[13:16],
-                                                 target_pos=state[0:3], # same as the current position
-                                                 target_rpy=np.array([0,0,state[9]]), # keep current yaw
-                                                 target_vel=self.SPEED_LIMIT * np.abs(action[3]) * v_unit_vector # target the desired velocity vector
-                                                 )
-            return rpm
-        elif self.ACT_TYPE == ActionType.ONE_D_RPM:
-            return np.repeat(self.HOVER_RPM * (1+0.05*action), 4)
-        elif self.ACT_TYPE == ActionType.ONE_D_DYN:
-            return nnlsRPM(thrust=(self.GRAVITY*(1+0.05*action[0])),
-                           x_torque=0,
-                           y_torque=0,
-                           z_torque=0,
-                           counter=self.step_counter,
-                           max_thrust=self.MAX_THRUST,
-                           max_xy_torque=self.MAX_XY_TORQUE,
-                           max_z_torque=self.MAX_Z_TORQUE,
-                           a=self.A,
-                           inv_a=self.INV_A,
-                           b_coeff=self.B_COEFF,
-                           gui=self.GUI
-                           )
-        elif self.ACT_TYPE == ActionType.ONE_D_PID:
-            state = self._getDroneStateVector(0)
-            rpm, _, _ = self.ctrl.computeControl(control_timestep=self.AGGR_PHY_STEPS*self.TIMESTEP, 
-                                                 cur_pos=state[0:3],
-                                                 cur_quat=state[3:7],
-                                                 cur_vel=state[10:13],
-                                                 cur_ang_vel=state[13:16],
-                                                 target_pos=state[0:3]+0.1*np.array([0,0,action[0]])
-                                                 )
+        return rpm
+
+    def _preprocessAction_pid(self, action):
+        """Pre-processes an ActionType.PID action, see `_preprocessAction()`."""
+        state = self._step_state
+        rpm, _, _ = self.ctrl.computeControl(control_timestep=self.CTRL_TIMESTEP, 
+                                             cur_pos=state[0:3],
+                                             cur_quat=state[3:7],
+                                             cur_vel=state[10:13],
+                                             cur_ang_vel=state[13:16],
+                                             target_pos=state[0:3]+0.1*action
+                                             )
+        return rpm
+
+    def _preprocessAction_vel(self, action):
+        """Pre-processes an ActionType.VEL action, see `_preprocessAction()`."""
+        state = self._step_state
+        a = action[0:3]
+        n2 = float(a[0]*a[0] + a[1]*a[1] + a[2]*a[2])
+        v_unit_vector = a / np.sqrt(n2) if n2 > 0. else _ZERO3
+        pos = state[0:3]
+        rpm, _, _ = self.ctrl.computeControl(control_timestep=self.CTRL_TIMESTEP, 
+                                             cur_pos=pos,
+                                             cur_quat=state[3:7],
+                                             cur_vel=state[10:13],
+                                             cur_ang_vel=state[13:16],
+                                             target_pos=pos, # same as the current position
+                                             target_rpy=np.array([0,0,state[9]]), # keep current yaw
+                                             target_vel=self.SPEED_LIMIT * np.abs(action[3]) * v_unit_vector # target the desired velocity vector
+                                             )
+        return rpm
+
+    def _preprocessAction_tun(self, action):
+        """Pre-processes an ActionType.TUN action, see `_preprocessAction()`."""
+        self.ctrl.setPIDCoefficients(p_coeff_pos=(action[0]+1)*self.TUNED_P_POS,
+                                     i_coeff_pos=(action[1]+1)*self.TUNED_I_POS,
+                                     d_coeff_pos=(action[2]+1)*self.TUNED_D_POS,
+                                     p_coeff_att=(action[3]+1)*self.TUNED_P_ATT,
+                                     i_coeff_att=(action[4]+1)*self.TUNED_I_ATT,
+                                     d_coeff_att=(action[5]+1)*self.TUNED_D_ATT
+                                     )
+        return self._trajectoryTrackingRPMs() 
+
+    def _preprocessAction_one_d_rpm(self, action):
+        """Pre-processes an ActionType.ONE_D_RPM action, see `_preprocessAction()`."""
+        return _one_d_rpm_jit(action, self.HOVER_RPM, np.empty(4))
+
+    def _preprocessAction_one_d_dyn(self, action):
+        """Pre-processes an ActionType.ONE_D_DYN action, see `_preprocessAction()`."""
+        thrust = self.GRAVITY*(1+0.05*action[0])
+        #### Fall back to NNLS when clipping (or GUI warnings) are needed
+        rpm = np.empty(4)
+        if not self.GUI and _dyn_mix(self._inv_a_c, self.B_COEFF, thrust, 0., 0., 0., rpm):
             return rpm
-        else:
-            print("[ERROR] in BaseSingleAgentAviary._preprocessAction()")
+        return nnlsRPM(thrust=thrust,
+                       x_torque=0,
+                       y_torque=0,
+                       z_torque=0,
+                       counter=self.step_counter,
+                       max_thrust=self.MAX_THRUST,
+                       max_xy_torque=self.MAX_XY_TORQUE,
+                       max_z_torque=self.MAX_Z_TORQUE,
+                       a=self.A,
+                       inv_a=self.INV_A,
+                       b_coeff=self.B_COEFF,
+                       gui=self.GUI
+                       )
+
+    def _preprocessAction_one_d_pid(self, action):
+        """Pre-processes an ActionType.ONE_D_PID action, see `_preprocessAction()`."""
+        state = self._step_state
+        rpm, _, _ = self.ctrl.computeControl(control_timestep=self.CTRL_TIMESTEP, 
+                                             cur_pos=state[0:3],
+                                             cur_quat=state[3:7],
+                                             cur_vel=state[10:13],
+                                             cur_ang_vel=state[13:16],
+                                             target_pos=state[0:3]+0.1*np.array([0,0,action[0]])
+                                             )
+        return rpm
 
     ################################################################################
 
@@ -333,7 +643,7 @@ class MyAviary(BaseAviary):
         Returns
         -------
         ndarray
-            A Box() of shape (H,W,4) or (12,) depending on the observation type.
+            A Box() of shape (H,W,4) or (18,) depending on the observation type.
         """
         if self.OBS_TYPE == ObservationType.RGB:
             return spaces.Box(low=0,
@@ -349,9 +659,9 @@ class MyAviary(BaseAviary):
             # obs_upper_bound = np.array([1,       1,       1,      1,   1,   1,   1,   1,      1,      1,      1,       1,       1,       1,       1,       1,       1,            1,            1,            1])          
             # return spaces.Box( low=obs_lower_bound, high=obs_upper_bound, dtype=np.float32 )
             ############################################################
-            #### OBS SPACE OF SIZE 12
-            return spaces.Box(low=np.array([-1,-1,0, -1,-1,-1, -1,-1,-1, -1,-1,-1]),
-                              high=np.array([1,1,1, 1,1,1, 1,1,1, 1,1,1]),
+            #### OBS SPACE OF SIZE 18, as returned by _computeObs_kin()
+            return spaces.Box(low=_KIN_LOW,
+                              high=_KIN_HIGH,
                               dtype=np.float32
                               )
             ############################################################
@@ -362,37 +672,41 @@ class MyAviary(BaseAviary):
 
     def _computeObs(self):
         """Returns the current observation of the environment.
+        The handler of each observation type is looked up by integer tag in
+        `_obs_dispatch`; `__init__()` binds the handler of `obs` directly
+        to the instance, bypassing this method, unless a subclass overrides it.
         Returns
         -------
         ndarray
-            A Box() of shape (H,W,4) or (12,) depending on the observation type.
+            A Box() of shape (H,W,4) or (18,) depending on the observation type.
+            The (18,)-shaped kinematic observation is filled in a preallocated
+            buffer and returned as a new copy, safe to keep across steps.
         """
-        if self.OBS_TYPE == ObservationType.RGB:
-            if self.step_counter%self.IMG_CAPTURE_FREQ == 0: 
-                self.rgb[0], self.dep[0], self.seg[0] = self._getDroneImages(0,
-                                                                             segmentation=False
-                                                                             )
-                #### Printing observation to PNG frames example ############
-                if self.RECORD:
-                    self._exportImage(img_type=ImageType.RGB,
-                                      img_input=self.rgb[0],
-                                      path=self.ONBOARD_IMG_PATH,
-                                      frame_num=int(self.step_counter/self.IMG_CAPTURE_FREQ)
-                                      )
-            return self.rgb[0]
-            ############################################################
-        elif self.OBS_TYPE == ObservationType.KIN: 
-            obs = self._getDroneStateVector(0)
-            diff = self.target_position - obs[0:3]
-            Rotation_matrix = p.getMatrixFromQuaternion(p.getQuaternionFromEuler(obs[7:10]))
-            
-         
-            #### OBS SPACE OF SIZE 18s##################################
-           
-            return np.hstack([diff, obs[10:13], obs[13:16], Rotation_matrix]).reshape(18,)
-            ############################################################
-        else:
-            print("[ERROR] in BaseSingleAgentAviary._computeObs()")
+        return self._obs_dispatch[self._obs_tag]()
+
+    ################################################################################
+
+    def _computeObs_rgb(self):
+        """Returns an ObservationType.RGB observation, see `_computeObs()`."""
+        if self.step_counter%self.IMG_CAPTURE_FREQ == 0: 
+            self.rgb[0], self.dep[0], self.seg[0] = self._getDroneImages(0,
+                                                                         segmentation=False
+                                                                         )
+            #### Printing observation to PNG frames example ############
+            if self.RECORD:
+                self._exportImage(img_type=ImageType.RGB,
+                                  img_input=self.rgb[0],
+                                  path=self.ONBOARD_IMG_PATH,
+                                  frame_num=int(self.step_counter/self.IMG_CAPTURE_FREQ)
+                                  )
+        return self.rgb[0]
+
+    def _computeObs_kin(self):
+        """Returns an ObservationType.KIN observation, see `_computeObs()`."""
+        obs = self._step_state
+        #### OBS SPACE OF SIZE 18 ##################################
+        #### The caller keeps the previous observation, return a copy
+        return _kin_obs(self.target_position, obs, self._obs_buf).copy()
     
     ################################################################################
     
@@ -405,36 +719,10 @@ class MyAviary(BaseAviary):
             The reward.
         """
         
-        state = self._getDroneStateVector(0)
-        pos =state[0:3]
-        target_position = self.target_position
-        att = state[7:10]
-        vel = state[10:13]
-        ang_vel = state[13:16]
-        action = self._invProcessAction(state[16:])
-
-        if self.prev_action is not None:
-            da = (action - self.prev_action)/self.AGGR_PHY_STEPS
-            self.prev_action = action
-        else:
-            da = action/self.AGGR_PHY_STEPS
-            self.prev_action = action
-        
-        da = np.linalg.norm(da)
-        
-        pos_err = np.linalg.norm(pos - target_position)    
-        att_err = np.linalg.norm(att)
-        vel_err = np.linalg.norm(vel)
-        ang_vel_err = np.linalg.norm(ang_vel)
-        act_err = np.linalg.norm(action)
-                
-        reward = 2.0 -  1.0 * pos_err - 0.04 * vel_err  -0.02 * att_err - 0.02 * act_err - 0.001*da
-        return reward      
+        #### On the first step, prev_action is all zeros ##########
+        return _reward_kernel(self._step_state, self.target_position, self.HOVER_RPM, self.prev_action, self.AGGR_PHY_STEPS)
     #################################################################################
     
-    def _invProcessAction(self, action):
-        return ((action/self.HOVER_RPM) - 1.0) * 20.0
-    
     def _computeDone(self):
         """Computes the current done value.
         Returns
@@ -442,23 +730,10 @@ class MyAviary(BaseAviary):
         bool
             Whether the current episode is done.
         """
-        state = self._getDroneStateVector(0)
-        curr_pos = state[0:3]
-        curr_att = state[7:10]
-       
-        done = False
-        
-        if np.abs(curr_pos[0])>3. or np.abs(curr_pos[1])>3. or np.abs(curr_pos[2])>3 or np.abs(curr_pos[2])<0.02:
-            done = True
-            
-        
-        elif np.abs(curr_att[0])>np.pi/2.0 or np.abs(curr_att[1])>np.pi/2.0 or np.abs(curr_att[2])>np.pi/2.0:
-            done = True
-            
-#         elif self.step_counter/self.SIM_FREQ > self.EPISODE_LEN_SEC:
-#             done = True
-
-        return done
+        state = self._step_state
+#         if self.step_counter/self.SIM_FREQ > self.EPISODE_LEN_SEC:
+#             return True
+        return _done_kernel(state)
     
     ##################################################################################
     
@@ -470,8 +745,73 @@ class MyAviary(BaseAviary):
         dict[str, int]
             Dummy value.
         """
+        #### A new dict per step: vec env workers add keys to it ###
         return {"answer": 42} #### Calculated by the Deep Thought supercomputer in 7.5M years
     ###################################################################################
-    
-    
 
+################################################################################
+
+def make_env(rank, seed=0, **kwargs):
+    """Returns a function creating a seeded `MyAviary`, e.g. for a worker process.
+    Parameters
+    ----------
+    rank : int
+        The index of the environment, added to `seed`.
+    seed : int, optional
+        The base random seed.
+    **kwargs
+        Arguments passed to `MyAviary`; leave `gui=False` so that each
+        environment runs its own PyBullet DIRECT client.
+    Returns
+    -------
+    callable
+        A function without arguments returning the environment.
+    """
+    def _init():
+        np.random.seed(seed + rank)
+        env = MyAviary(**kwargs)
+        env.action_space.seed(seed + rank)
+        return env
+    return _init
+
+################################################################################
+
+def make_vec_env(num_envs, seed=0, **kwargs):
+    """Creates `num_envs` copies of `MyAviary`, each stepping in its own process.
+    Requires stable-baselines3.
+    Parameters
+    ----------
+    num_envs : int
+        The number of parallel environments.
+    seed : int, optional
+        The base random seed, the i-th environment is seeded with `seed+i`.
+    **kwargs
+        Arguments passed to each `MyAviary`.
+    Returns
+    -------
+    SubprocVecEnv
+        The vectorized environment.
+    """
+    from stable_baselines3.common.vec_env import SubprocVecEnv
+    return SubprocVecEnv([make_env(i, seed, **kwargs) for i in range(num_envs)])
+
+################################################################################
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    #### Measure the sampling throughput with random actions ##
+    parser = argparse.ArgumentParser(description='Random-action throughput of MyAviary in parallel processes')
+    parser.add_argument('--num-envs', default=4, type=int, help='Number of parallel environments (default: 4)', metavar='')
+    parser.add_argument('--steps', default=1000, type=int, help='Number of vectorized steps (default: 1000)', metavar='')
+    parser.add_argument('--seed', default=0, type=int, help='Base random seed (default: 0)', metavar='')
+    ARGS = parser.parse_args()
+
+    env = make_vec_env(ARGS.num_envs, seed=ARGS.seed)
+    env.reset()
+    start = time.time()
+    for _ in range(ARGS.steps):
+        env.step(np.array([env.action_space.sample() for _ in range(ARGS.num_envs)]))
+    elapsed = time.time() - start
+    env.close()
+    print("{:d} envs, {:d} steps in {:.2f}s ({:.0f} env steps/s)".format(ARGS.num_envs, ARGS.steps, elapsed, ARGS.num_envs*ARGS.steps/elapsed))